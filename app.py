@@ -1,17 +1,20 @@
 import streamlit as st
 import pandas as pd
-import gspread
-from google.oauth2.service_account import Credentials
-import plotly.express as px
-import plotly.graph_objects as go
+import numpy as np
 from datetime import datetime
+from config import DEPARTMENTS, DEFAULT_STYLES
 
 # --- 1. Googleスプレッドシート設定 ---
 SCOPE = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
 SHEET_NAME = "勉強効率化システム_データ"  # スプレッドシートのファイル名
 
+@st.cache_resource(ttl=3600)
 def get_gsheet_client():
-    """Secretsから認証情報を取得し、GSheetsクライアントを返す"""
+    """Secretsから認証情報を取得し、GSheetsクライアントを返す（1時間キャッシュ）"""
+    # 接続時にだけ必要なライブラリは初回呼び出し時に読み込む
+    import gspread
+    from google.oauth2.service_account import Credentials
+
     creds_info = dict(st.secrets["gcp_service_account"])
     # 秘密鍵の改行エスケープを修正
     if "private_key" in creds_info:
@@ -21,26 +24,120 @@ def get_gsheet_client():
     client = gspread.authorize(creds)
     return client
 
-def load_data():
-    """スプレッドシートから全データを読み込む"""
+@st.cache_resource(ttl=3600)
+def get_worksheet():
+    """書き込み先のワークシートを返す（client.open のファイル検索を毎回行わない）"""
     client = get_gsheet_client()
-    sheet = client.open(SHEET_NAME).sheet1
-    data = sheet.get_all_records()
-    return pd.DataFrame(data)
+    return client.open(SHEET_NAME).sheet1
 
-def save_data(new_row):
-    """スプレッドシートに新しい行を追加する"""
-    client = get_gsheet_client()
-    sheet = client.open(SHEET_NAME).sheet1
-    sheet.append_row(new_row)
+# load_data が分析用に追加する列（履歴・CSVには含めない）
+DERIVED_COLUMNS = ["_score", "_study_time", "_dept", "_styles", "学習効率"]
+
+def _narrow(values, dtype):
+    """全ての値が整数で型の範囲に収まるときだけ小さい整数型にする（それ以外はfloatのまま）"""
+    info = np.iinfo(dtype.lower())
+    valid = values.dropna()
+    if ((valid % 1 == 0) & valid.between(info.min, info.max)).all():
+        return values.astype(dtype)
+    return values
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_data():
+    """スプレッドシートから全データを読み込む（60秒キャッシュ、保存時に破棄）"""
+    from gspread.utils import absolute_range_name
+
+    sheet = get_worksheet()
+    # values.get を直接呼び、数値は型付きのまま受け取る（日付は表示形式の文字列のまま）
+    res = sheet.spreadsheet.values_get(
+        absolute_range_name(sheet.title),
+        params={
+            "valueRenderOption": "UNFORMATTED_VALUE",
+            "dateTimeRenderOption": "FORMATTED_STRING",
+            "majorDimension": "ROWS",
+        },
+    )
+    values = res.get("values", [])
+    if not values:
+        return pd.DataFrame()
+    # 1行目をヘッダーとして、リストのリストからそのままDataFrameを作る
+    # （API は行末の空セルを省くため、各行をヘッダーの列数にそろえる）
+    header = values[0]
+    width = len(header)
+    rows = [(row + [""] * (width - len(row)))[:width] for row in values[1:]]
+    df = pd.DataFrame(rows, columns=header)
+    # 元の列はシートの値のまま残し（履歴・CSV用）、分析用の列を別に作る
+    score = pd.to_numeric(df["点数"], errors="coerce")
+    study_time = pd.to_numeric(df["勉強時間"], errors="coerce")
+    # 効率指標 = 点数 ÷ 時間（1分あたりの獲得点数）。勉強時間が0以下の行は0、欠損の行は欠損とする
+    t = study_time.to_numpy(dtype=np.float64)
+    sc = score.to_numpy(dtype=np.float64)
+    eff = np.where(np.isnan(t), np.nan, 0.0)
+    np.divide(sc, t, out=eff, where=t > 0)
+    df["学習効率"] = eff
+    df["_score"] = _narrow(score, "UInt8")
+    df["_study_time"] = _narrow(study_time, "UInt16")
+    df["_dept"] = df["学科"].astype("category")
+    # 授業スタイルは読み込み時に一度だけ分割し、行ごとのスタイル集合として持っておく
+    df["_styles"] = df["授業スタイル"].fillna("").astype(str).str.split(",").map(
+        lambda xs: frozenset(x.strip() for x in xs if x.strip())
+    )
+    return df
+
+def extract_styles(col) -> frozenset:
+    """行ごとのスタイル集合から重複のないスタイル一覧を取り出す"""
+    return frozenset().union(*col)
+
+def save_data(rows):
+    """スプレッドシートに複数行をまとめて追加する（API呼び出しは1回）"""
+    sheet = get_worksheet()
+    sheet.append_rows(rows)
+    # 追加した行が次回の読み込みに反映されるようキャッシュを破棄
+    load_data.clear()
+
+def flush_pending_rows():
+    """セッションにためた未送信の行をスプレッドシートに書き込む"""
+    pending = st.session_state.pending_rows
+    if pending:
+        save_data(pending)
+        pending.clear()
+
+@st.cache_data(ttl=60, max_entries=4)
+def df_to_csv(df: pd.DataFrame) -> bytes:
+    """ダウンロード用にDataFrameをCSVへ変換する（同じデータなら再変換しない）"""
+    return df.to_csv(index=False).encode("utf-8")
+
+# --- グラフ作成（入力が同じ間はキャッシュした図を再利用） ---
+@st.cache_data(max_entries=32)
+def build_bar(keys: tuple, scores: tuple, times: tuple):
+    """授業スタイル別の平均点数・平均時間の棒グラフを作る"""
+    import plotly.graph_objects as go
+
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=keys, y=scores, name="平均点数", marker_color='indianred'))
+    fig.add_trace(go.Bar(x=keys, y=times, name="平均時間(分)", marker_color='lightsalmon'))
+    fig.update_layout(title="授業スタイル別：点数と時間の比較", barmode='group')
+    return fig
+
+@st.cache_data(ttl=60, max_entries=4)
+def build_scatter(df):
+    """勉強時間と点数の散布図を作る"""
+    import plotly.express as px
+
+    return px.scatter(
+        df, x="勉強時間", y="点数", color="学科",
+        hover_data=["名前", "授業スタイル"],
+        title="全体分布：勉強時間 vs テスト点数（右上にいくほど理想的）"
+    )
 
 # --- 定数設定 ---
-DEPARTMENTS = ["情報工学科", "自動車工学科", "電気エネルギー工学科", "映像音響学科", "家具クラフト学科"]
-DEFAULT_STYLES = ["教科書中心", "スライド利用", "実習あり", "グループワーク", "課題提出あり"]
+FLUSH_THRESHOLD = 10  # 未送信の行がこの件数に達したら自動で書き込む
 
 # --- 2. 画面構成 (UI) ---
 st.set_page_config(page_title="勉強効率化システム", layout="wide")
 
+# 入力データは一旦セッションにため、まとめてスプレッドシートへ書き込む
+st.session_state.setdefault("pending_rows", [])
+
 # タイトル表示（資料1枚目イメージ）
 st.title("勉強を効率的にできるシステム")
 st.caption("Bチーム制作：KIST学習最適化プロジェクト")
@@ -81,74 +178,93 @@ with tab_input:
             else:
                 style_str = ",".join(selected_styles)
                 new_row = [str(date), name, dept, score, study_time, style_str]
-                save_data(new_row)
-                st.success(f"{name}さんのデータをスプレッドシートに保存しました！")
+                st.session_state.pending_rows.append(new_row)
+                if len(st.session_state.pending_rows) >= FLUSH_THRESHOLD:
+                    flush_pending_rows()
+                    st.success(f"{name}さんのデータを含む未送信分をスプレッドシートに保存しました！")
+                # 件数に満たないときは下の未送信データの案内で知らせる
+
+    # 未送信データの手動書き込み
+    # ボタンの処理を先に済ませてから案内を出し、「未送信」と「保存しました」が同時に出ないようにする
+    if st.session_state.pending_rows:
+        notice = st.empty()
+        if st.button("スプレッドシートに書き込む"):
+            flush_pending_rows()
+            notice.success("未送信のデータをスプレッドシートに保存しました！")
+        else:
+            notice.warning(
+                "データを受け付けましたが、まだスプレッドシートには保存されていません"
+                f"（未送信 {len(st.session_state.pending_rows)} 件）。"
+                "「スプレッドシートに書き込む」を押す前にページを閉じると失われます。"
+            )
+
+# --- 分析・履歴タブで共有するデータ ---
+# 入力タブでの書き込みが済んでから1回だけ読み込み、結果・例外を両タブで使う
+try:
+    df_all = load_data()
+    load_error = None
+except Exception as e:
+    df_all, load_error = None, e
 
 # --- 4. 分析・比較タブ (FR-03) ---
 with tab_analysis:
     st.header("授業スタイル別の効果分析")
     
     try:
-        df = load_data()
+        if load_error is not None:
+            raise load_error
         
-        if df.empty:
+        if df_all.empty:
             st.info("データがまだありません。入力を先に完了させてください。")
         else:
-            # データのクリーニングと効率計算
-            df['点数'] = pd.to_numeric(df['点数'], errors='coerce')
-            df['勉強時間'] = pd.to_numeric(df['勉強時間'], errors='coerce')
-            # 効率指標 = 点数 ÷ 時間（1分あたりの獲得点数）
-            df['学習効率'] = df['点数'] / df['勉強時間'].replace(0, 1)
-
             # --- スタイル比較セクション ---
             st.subheader("🔍 スタイルの絞り込み比較")
             
-            # 全スタイルを抽出
-            all_styles_in_data = set()
-            for s in df["授業スタイル"].astype(str).str.split(","):
-                if isinstance(s, list): all_styles_in_data.update([x.strip() for x in s if x.strip()])
+            # 全スタイルを抽出（読み込み時に作ったスタイル集合をまとめるだけ）
+            all_styles_in_data = sorted(extract_styles(df_all["_styles"]))
             
             selected_styles_comp = st.multiselect(
                 "比較したいスタイルを選んでください",
-                options=list(all_styles_in_data),
-                default=list(all_styles_in_data)[:3] if len(all_styles_in_data) >= 3 else list(all_styles_in_data)
+                options=all_styles_in_data,
+                default=all_styles_in_data[:3]
             )
 
             if selected_styles_comp:
                 # 選択されたスタイルごとの平均を算出
-                comparison_list = []
-                for style in selected_styles_comp:
-                    style_mask = df["授業スタイル"].str.contains(style, na=False)
-                    subset = df[style_mask]
-                    if not subset.empty:
-                        comparison_list.append({
-                            "授業スタイル": style,
-                            "平均点数": subset["点数"].mean(),
-                            "平均勉強時間": subset["勉強時間"].mean(),
-                            "平均学習効率": subset["学習効率"].mean()
-                        })
-                
-                comp_df = pd.DataFrame(comparison_list)
-
-                # メトリクスの表示
-                m_cols = st.columns(len(comparison_list))
-                for i, row in enumerate(comparison_list):
-                    with m_cols[i]:
-                        st.metric(row["授業スタイル"], f"{row['平均点数']:.1f}点", f"効率 {row['平均学習効率']:.2f}")
+                # スタイルを1行1件に展開し、groupby 1回で全指標を集計する
+                # 展開と絞り込みはスタイル集合の列だけで行い、集計に必要な列を1回で取り出す
+                styles = df_all["_styles"].explode()
+                styles = styles[styles.isin(selected_styles_comp)]
+                tmp = df_all.loc[styles.index, ["_score", "_study_time", "学習効率"]].assign(style=styles.to_numpy())
+                comp_df = tmp.groupby("style", sort=False).agg(
+                    平均点数=("_score", "mean"),
+                    平均勉強時間=("_study_time", "mean"),
+                    平均学習効率=("学習効率", "mean")
+                )
+                # 選択順に並べる（該当データのないスタイルは除外）
+                comp_df = comp_df.reindex([x for x in selected_styles_comp if x in comp_df.index])
+                comp_df = comp_df.rename_axis("授業スタイル").reset_index()
+
+                # メトリクスの表示（表示用の文字列はループの前にまとめて作る）
+                titles = comp_df["授業スタイル"].tolist()
+                vals = [f"{v:.1f}点" for v in comp_df["平均点数"]]
+                deltas = [f"効率 {v:.2f}" for v in comp_df["平均学習効率"]]
+                if titles:
+                    m_cols = st.columns(len(titles))
+                    for c, t, v, d in zip(m_cols, titles, vals, deltas):
+                        c.metric(t, v, d)
 
                 # グラフ表示
-                fig = go.Figure()
-                fig.add_trace(go.Bar(x=comp_df["授業スタイル"], y=comp_df["平均点数"], name="平均点数", marker_color='indianred'))
-                fig.add_trace(go.Bar(x=comp_df["授業スタイル"], y=comp_df["平均勉強時間"], name="平均時間(分)", marker_color='lightsalmon'))
-                
-                fig.update_layout(title="授業スタイル別：点数と時間の比較", barmode='group')
+                fig = build_bar(
+                    tuple(comp_df["授業スタイル"]), tuple(comp_df["平均点数"]), tuple(comp_df["平均勉強時間"])
+                )
                 st.plotly_chart(fig, use_container_width=True)
 
                 # 効率の散布図
-                fig_scatter = px.scatter(
-                    df, x="勉強時間", y="点数", color="学科", 
-                    hover_data=["名前", "授業スタイル"],
-                    title="全体分布：勉強時間 vs テスト点数（右上にいくほど理想的）"
+                fig_scatter = build_scatter(
+                    df_all[["_study_time", "_score", "_dept", "名前", "授業スタイル"]].rename(
+                        columns={"_study_time": "勉強時間", "_score": "点数", "_dept": "学科"}
+                    )
                 )
                 st.plotly_chart(fig_scatter, use_container_width=True)
             
@@ -159,8 +275,11 @@ with tab_analysis:
 with tab_history:
     st.header("全データ履歴")
     try:
-        current_df = load_data()
+        # 分析タブと同じ読み込み結果を再利用する
+        if load_error is not None:
+            raise load_error
+        current_df = df_all.drop(columns=DERIVED_COLUMNS, errors="ignore")
         st.dataframe(current_df, use_container_width=True)
-        st.download_button("CSVとしてダウンロード", current_df.to_csv(index=False), "study_data.csv", "text/csv")
+        st.download_button("CSVとしてダウンロード", df_to_csv(current_df), "study_data.csv", "text/csv")
     except:
         st.write("データを読み込めませんでした。")
\ No newline at end of file
@@ -43,11 +43,12 @@ if uploaded_file is not None:
                 #tagger = MeCab.Tagger()
                 tagger = MeCab.Tagger(ipadic.MECAB_ARGS)
                 node = tagger.parseToNode(text)
+                selected_pos_set = frozenset(selected_pos) # 品詞の判定をO(1)で行う
                 words = []
                 while node:
                     if node.surface.strip() != "":
                         word_type = node.feature.split(",")[0]
-                        if word_type in selected_pos: # 対象外の品詞はスキップ
+                        if word_type in selected_pos_set: # 対象外の品詞はスキップ
                             words.append(node.surface)
                     node = node.next
                 word_count = Counter(words)
@@ -75,12 +76,13 @@ if uploaded_file is not None:
                 #tagger = MeCab.Tagger()
                 tagger = MeCab.Tagger(ipadic.MECAB_ARGS)
                 node = tagger.parseToNode(text)
+                selected_pos_set = frozenset(selected_pos) # 品詞の判定をO(1)で行う
 
                 # 品詞ごとに出現単語と出現回数をカウント
                 pos_word_count_dict = {}
                 while node:
                     pos = node.feature.split(",")[0]
-                    if pos in selected_pos:
+                    if pos in selected_pos_set:
                         if pos not in pos_word_count_dict:
                             pos_word_count_dict[pos] = {}
                         if node.surface.strip() != "":
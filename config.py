@@ -0,0 +1,3 @@
+# --- 画面で使う選択肢の設定 ---
+DEPARTMENTS = ["情報工学科", "自動車工学科", "電気エネルギー工学科", "映像音響学科", "家具クラフト学科"]
+DEFAULT_STYLES = ["教科書中心", "スライド利用", "実習あり", "グループワーク", "課題提出あり"]